@@ -18,6 +18,11 @@ except ImportError:
     from io import StringIO
     from io import BytesIO
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 #############################################################################
 ##  this file is part of pasta.
 ##  see "license.txt" for terms and conditions of usage.
@@ -27,7 +32,9 @@ except ImportError:
 Simple classes for reading and manipulating sequence data matrices
 """
 
-import re, os
+import re, os, mmap
+from bisect import bisect_left
+from array import array
 from pasta import get_logger, log_exception, MESSENGER, TIMING_LOG
 from pasta.filemgr import open_with_intermediates
 
@@ -37,6 +44,7 @@ _LOG = get_logger(__name__)
 _INDEL = re.compile(r"[-]")
 _DANGEROUS_NAME_CHARS = re.compile(r"[^a-zA-Z0-9]")
 ILLEGAL_CHARS = re.compile(r"[^a-zA-Z?-]")
+_GAP_BYTE = ord('-')
 
 
 DATASET_TAXA_ATTR = "taxon_namespaces"
@@ -79,6 +87,84 @@ def read_fasta(src):
     if isinstance(src, str):
         file_obj.close()
 
+_BULK_UPPER = bytes.maketrans(b"abcdefghijklmnopqrstuvwxyz", b"ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_BULK_WHITESPACE = b" \t\r\n\x0b\x0c"
+_BULK_LEGAL = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ?-"
+
+def _bulk_content(src):
+    """Returns the content of `src` (a path or a file object) as a bytes-like
+    object. Files on disk are memory-mapped; other file objects are read in
+    one block.
+    """
+    if isinstance(src, str):
+        file_obj = open(src, "rb")
+        try:
+            return mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            return b""
+        finally:
+            file_obj.close()
+    elif isinstance(src, filetypes):
+        try:
+            if src.tell() == 0:
+                return mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        except (io.UnsupportedOperation, ValueError, OSError):
+            pass
+        data = src.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return data
+    else:
+        raise TypeError('FASTA reader cannot recognize the source of %s, %s' % (src,type(src)))
+
+def _iter_bulk_records(data):
+    """generator that returns (name, body, line_number) for each '>' record of
+    `data`, where body is the bytes between the header line and the next
+    record, and line_number is the (0-based) line of the header.
+    """
+    start = data.find(b">")
+    line_number = data[:start].count(b"\n") if start > 0 else 0
+    while start != -1:
+        eol = data.find(b"\n", start)
+        if eol == -1:
+            header, body, nxt = data[start+1:], b"", -1
+        else:
+            header = data[start+1:eol]
+            nxt = data.find(b"\n>", eol)
+            body = data[eol+1:] if nxt == -1 else data[eol+1:nxt]
+        yield header.decode("utf-8").strip(), body, line_number
+        line_number += 1 + body.count(b"\n") + (1 if nxt > eol else 0)
+        start = -1 if nxt == -1 else nxt + 1
+
+def _clean_bulk_sequence(body, line_number):
+    """Removes white space from `body` and converts it to upper case, checking
+    characters with a translation table. `line_number` is the line of the
+    first line of `body` and is only used for error reporting.
+    """
+    seq = body.translate(_BULK_UPPER, _BULK_WHITESPACE)
+    if seq.translate(None, _BULK_LEGAL):
+        for i, line in enumerate(body.split(b"\n")):
+            if line.translate(_BULK_UPPER, _BULK_WHITESPACE).translate(None, _BULK_LEGAL):
+                break
+        raise Exception("Error: illegal characeters in sequence at line %d" % (line_number + i))
+    return seq
+
+def read_fasta_bulk(src, as_bytes=False):
+    """generator that returns (name, sequence) tuples from either a FASTA
+    formatted file or file object. Same as read_fasta, but reads the whole 
+    input at once (memory-mapped when possible) and processes each sequence
+    with bytes.translate instead of per-line string operations.
+    
+    If `as_bytes` is True, sequences are returned as ASCII bytes objects.
+    """
+    data = _bulk_content(src)
+    for name, body, line_number in _iter_bulk_records(data):
+        seq = _clean_bulk_sequence(body, line_number + 1)
+        if name:
+            yield name, (seq if as_bytes else seq.decode("ascii"))
+    if isinstance(data, mmap.mmap):
+        data.close()
+
 def read_compact(src):
     """generator that returns (name, sequence) tuples from either a COMPACT
     formatted file or file object.
@@ -322,6 +408,37 @@ def read_compact3(src):
     if isinstance(src, str):
         file_obj.close()    
 
+def read_compact3_bulk(src):
+    """generator that returns (name, sequence) tuples from either a COMPACT3
+    formatted file or file object. Same as read_compact3, but reads the whole 
+    input at once and builds each gapped sequence in a single pass.
+    """
+    data = _bulk_content(src)
+    for name, body, line_number in _iter_bulk_records(data):
+        seq_list = []
+        gaps = []
+        for i, line in enumerate(body.split(b"\n")):
+            if line.startswith(b"@"):
+                gaps.extend((int(y[0]),int(y[1])+1) for y in (x.split(b"-") for x in line[1:].split()))
+            elif not line.startswith(b"#"):
+                seq = _clean_bulk_sequence(line, line_number + 1 + i).decode("ascii")
+                if seq.find("-") > -1 :
+                    raise Exception("gaps found in sequence portion. This does not seem to be COMPACT3 format.")
+                seq_list.append(seq)
+        residues = "".join(seq_list)
+        seq = []
+        lastpos = 0
+        used = 0
+        for (gs, ge) in gaps:
+            seq.append(residues[used:used+gs-lastpos])
+            seq.append("-"*(ge-gs))
+            used += gs-lastpos
+            lastpos = ge
+        seq.append(residues[used:])
+        yield name, "".join(seq)
+    if isinstance(data, mmap.mmap):
+        data.close()
+
 def write_phylip(alignment, dest):
     """Writes the `alignment` in relaxed PHYLIP format to either a file object or file"""
     file_obj = None
@@ -347,6 +464,53 @@ def write_nexus(alignment, file_obj):
     "TODO use dendropy"
     raise NotImplementedError('Output of NEXUS file format is not supported yet.')
 
+class UnalignedSequenceStore(dict):
+    """An immutable map of taxon name to its gap-free sequence.
+
+    Built once by `MultiLocusDataset.relabel_for_pasta` and shared (never
+    copied) by every alignment derived from that locus, so that `unaligned()`
+    only has to slice it instead of stripping gaps from every sequence again
+    in each iteration.
+    """
+    def __init__(self, sequences=()):
+        dict.__init__(self, sequences)
+
+    def from_alignment(alignment):
+        if isinstance(alignment, CompactAlignment):
+            return UnalignedSequenceStore((k, v.seq) for k, v in alignment.items())
+        return UnalignedSequenceStore((k, re.sub(_INDEL, '', str(v))) for k, v in alignment.items())
+    from_alignment = staticmethod(from_alignment)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("UnalignedSequenceStore objects cannot be modified")
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def covers(self, names):
+        for name in names:
+            if name not in self:
+                return False
+        return True
+
+    def sub_alignment(self, names, datatype):
+        "Returns an unaligned Alignment of `names`, skipping empty sequences."
+        new_alignment = Alignment()
+        new_alignment.datatype = datatype
+        for name in names:
+            seq = self[name]
+            if seq != '':
+                new_alignment[name] = seq
+        return new_alignment
+
 class Alignment(dict, object):
     """A simple class that maps taxa names to sequences.
     TODO: switch to dendropy character_matrix
@@ -355,6 +519,7 @@ class Alignment(dict, object):
         "creates an empty matrix"
         dict.__init__(self)
         self.datatype = None
+        self.unaligned_store = None
 
     def get_datatype(self):
         return self._datatype
@@ -389,13 +554,13 @@ class Alignment(dict, object):
         If duplicate sequence names are encountered then the old name will be replaced.
         """
         if ( file_format.upper() == 'FASTA' ):
-            read_func = read_fasta
+            read_func = read_fasta_bulk
         elif ( file_format.upper() == 'NEXUS' ):
             read_func = read_nexus
         elif ( file_format.upper() == 'PHYLIP' ):
             read_func = read_phylip
         elif ( file_format.upper() == 'COMPACT3' ):
-            read_func = read_compact3
+            read_func = read_compact3_bulk
         else:
             raise NotImplementedError("Unknown file format (%s) is not supported" % file_format)
         for name, seq in read_func(file_obj):
@@ -449,6 +614,9 @@ class Alignment(dict, object):
         """
         Returns a new alignment with all gaps and missing sequences removed.
         """
+        store = self.unaligned_store
+        if store is not None and store.covers(self):
+            return store.sub_alignment(self, self.datatype)
         new_alignment = Alignment()
         new_alignment.datatype = self.datatype
         for name, seq in self.items():
@@ -461,6 +629,7 @@ class Alignment(dict, object):
         "Creates an new alignment with a subset of the taxa."
         new_alignment = Alignment()
         new_alignment.datatype = self.datatype
+        new_alignment.unaligned_store = self.unaligned_store
         for key in sub_keys:
             if key in self:
                 new_alignment[key] = self[key]
@@ -499,6 +668,9 @@ class Alignment(dict, object):
     def mask_gapy_sites(self,minimum_seq_requirement):        
         n = len(list(self.values())[0])
         _LOG.debug("Masking alignment sites with fewer than %d characters from alignment with %d columns" %(minimum_seq_requirement,n))
+        if numpy is not None:
+            self._mask_gapy_sites_by_counts(n, minimum_seq_requirement)
+            return
         
 #        # The following implements row-based masking. Seems to be less efficient than column based
 #        masked = zip(range(0,n),[minimum_seq_requirement] * n)
@@ -546,6 +718,24 @@ class Alignment(dict, object):
         assert (len(masked) == n - nn), "Masking results is not making sense: %d %d %d" %(len(masked), n , nn)
         _LOG.debug("Masking done. Before masking: %d; After masking: %d; minimum requirement: %d;" %(n,nn,minimum_seq_requirement))
 
+    def _mask_gapy_sites_by_counts(self, n, minimum_seq_requirement):
+        '''
+        Vectorized version of mask_gapy_sites: counts the non-gap characters
+        of every column in one pass over the sequences, and then compacts each
+        sequence with a boolean column mask.
+        '''
+        counts = numpy.zeros(n, dtype=numpy.int64)
+        for seq in self.values():
+            counts += numpy.frombuffer(seq.encode('ascii'), dtype=numpy.uint8) != _GAP_BYTE
+        keep = counts >= minimum_seq_requirement
+        nn = int(keep.sum())
+        _LOG.debug("%d Columns identified for masking" %(n - nn))
+        if nn == n:
+            return
+        for k,seq in self.items():
+            self[k] = numpy.frombuffer(seq.encode('ascii'), dtype=numpy.uint8)[keep].tobytes().decode('ascii')
+        _LOG.debug("Masking done. Before masking: %d; After masking: %d; minimum requirement: %d;" %(n,nn,minimum_seq_requirement))
+
     def merge_in(self, she):
         merge_in(self,she)
 
@@ -823,6 +1013,157 @@ class SequenceDataset(object):
         _LOG.debug("Sequence validity check done. ")
         return True
 
+class TaxonIndex(object):
+    """Dense integer IDs (0 .. n-1) for a fixed set of taxon names.
+
+    `MultiLocusDataset.relabel_for_pasta` creates one for all the safe names
+    of a dataset; the AlignmentView objects made during decomposition keep
+    only sorted arrays of these IDs.
+    """
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def ids(self, names):
+        "Returns the sorted array of IDs of the `names` that are in the index."
+        index = self.index
+        return array('i', sorted(set(index[n] for n in names if n in index)))
+
+    def labels(self, ids):
+        names = self.names
+        return [names[i] for i in ids]
+
+def _intersect_sorted_ids(a, b):
+    "Intersection of two sorted ID arrays, in linear time."
+    r = array('i')
+    i = j = 0
+    la, lb = len(a), len(b)
+    while i < la and j < lb:
+        x, y = a[i], b[j]
+        if x < y:
+            i += 1
+        elif y < x:
+            j += 1
+        else:
+            r.append(x)
+            i += 1
+            j += 1
+    return r
+
+class AlignmentView(object):
+    """A read-only subset of the taxa of a (shared) base alignment.
+
+    Only the sorted indices of the taxa are stored, so recursively splitting
+    a dataset creates no new dictionaries.  The base alignment must not be
+    modified while views of it are alive.  Use `materialize` to get a regular
+    alignment object.
+    """
+    def __init__(self, base, indices=None, taxon_index=None):
+        self.base = base
+        if taxon_index is None:
+            taxon_index = TaxonIndex(base.keys())
+            if indices is None:
+                indices = array('i', range(len(taxon_index)))
+        elif indices is None:
+            indices = taxon_index.ids(base.keys())
+        self.taxon_index = taxon_index
+        self.indices = indices
+        self.datatype = base.datatype
+        self.unaligned_store = getattr(base, 'unaligned_store', None)
+
+    def _has_index(self, i):
+        j = bisect_left(self.indices, i)
+        return j < len(self.indices) and self.indices[j] == i
+
+    def sub_alignment(self, sub_keys):
+        "Creates a new view with the taxa of `sub_keys` that are in this view."
+        return self.sub_alignment_by_ids(self.taxon_index.ids(sub_keys))
+
+    def sub_alignment_by_ids(self, ids):
+        "Creates a new view with the taxa of the sorted `ids` that are in this view."
+        new_view = AlignmentView(self.base, _intersect_sorted_ids(self.indices, ids), self.taxon_index)
+        new_view.datatype = self.datatype
+        new_view.unaligned_store = self.unaligned_store
+        return new_view
+
+    def keys(self):
+        names = self.taxon_index.names
+        return [names[i] for i in self.indices]
+
+    def __iter__(self):
+        names = self.taxon_index.names
+        for i in self.indices:
+            yield names[i]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __contains__(self, key):
+        i = self.taxon_index.index.get(key)
+        return i is not None and self._has_index(i)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.base[key]
+
+    def items(self):
+        base = self.base
+        for name in self:
+            yield name, base[name]
+
+    def values(self):
+        base = self.base
+        for name in self:
+            yield base[name]
+
+    def get_sequence_names(self):
+        return self.keys()
+
+    def get_num_taxa(self):
+        return len(self.indices)
+
+    def is_empty(self):
+        return len(self.indices) < 1
+
+    def materialize(self):
+        "Returns a regular alignment (of the base's class) with the taxa of this view."
+        new_alignment = self.base.sub_alignment(self)
+        new_alignment.datatype = self.datatype
+        new_alignment.unaligned_store = self.unaligned_store
+        return new_alignment
+
+    def unaligned(self):
+        store = self.unaligned_store
+        if store is not None and store.covers(self):
+            return store.sub_alignment(self, self.datatype)
+        return self.materialize().unaligned()
+
+    def write_filepath(self, filename, file_format='FASTA', zipout=False):
+        """Writes the sequence data in the specified `file_format` to `filename`"""
+        if zipout or file_format.upper() != 'FASTA':
+            self.materialize().write_filepath(filename, file_format, zipout)
+            return
+        file_obj = open_with_intermediates(filename,'w')
+        self.write(file_obj, file_format)
+        file_obj.close()
+
+    def write(self, file_obj, file_format):
+        """Writes the sequence data in the specified `file_format` to `file_obj`"""
+        if file_format.upper() != 'FASTA':
+            self.materialize().write(file_obj, file_format)
+            return
+        base = self.base
+        if isinstance(base, CompactAlignment):
+            for name in self:
+                file_obj.write('>%s\n%s\n' % (name, base.as_string_sequence(name)))
+        else:
+            for name in self:
+                file_obj.write('>%s\n%s\n' % (name, base[name]))
+
 class MultiLocusDataset(list):
     def __init__(self, a=()):
         list.__init__(self, a)
@@ -830,6 +1171,8 @@ class MultiLocusDataset(list):
         self.filename_list = []
         self.taxa_label_to_taxon = {}
         self.dataset = None
+        self.unaligned_stores = []
+        self.taxon_index = None
 
     def new_with_shared_meta(self):
         m =  MultiLocusDataset()
@@ -837,6 +1180,8 @@ class MultiLocusDataset(list):
         m.filename_list = self.filename_list
         m.taxa_label_to_taxon = self.taxa_label_to_taxon
         m.dataset = self.dataset
+        m.unaligned_stores = self.unaligned_stores
+        m.taxon_index = self.taxon_index
         return m
 
     def read_files(self,
@@ -965,6 +1310,12 @@ class MultiLocusDataset(list):
         del self[:]
         for a in alignment_list:
             self.append(a)
+        self.taxon_index = TaxonIndex(self.safe_to_real_names)
+        self.unaligned_stores = []
+        for a in alignment_list:
+            store = UnalignedSequenceStore.from_alignment(a)
+            a.unaligned_store = store
+            self.unaligned_stores.append(store)
 
     def _convert_rna_to_dna(self, reverse=False):
         if reverse:
@@ -987,6 +1338,10 @@ class MultiLocusDataset(list):
             else:
                 for taxon, seq in element.items():
                     element[taxon] = seq.replace(match_char, replace_char)
+                if n < len(self.unaligned_stores):
+                    store = UnalignedSequenceStore((k, v.replace(match_char, replace_char)) for k, v in self.unaligned_stores[n].items())
+                    self.unaligned_stores[n] = store
+                    element.unaligned_store = store
             element.datatype = new_datatype
 
 
@@ -1046,13 +1401,54 @@ class MultiLocusDataset(list):
             for k, v in new_aln.items():
                 alignment[k] = v
         self.safe_to_real_names = {}
+        self.taxon_index = None
+    def attach_unaligned_stores(self):
+        """Points each locus alignment at the shared store of gap-free
+        sequences built by relabel_for_pasta (if any)."""
+        for n, alignment in enumerate(self):
+            if n < len(self.unaligned_stores):
+                alignment.unaligned_store = self.unaligned_stores[n]
+
     def sub_alignment(self, taxon_names):
+        """Returns a MultiLocusDataset of AlignmentView objects, so that
+        no sequence dictionaries are copied while decomposing the dataset."""
+        if self.taxon_index is None:
+            m = self.new_with_shared_meta()
+            for alignment in self:
+                if not isinstance(alignment, AlignmentView):
+                    alignment = AlignmentView(alignment)
+                m.append(alignment.sub_alignment(taxon_names))
+            m.attach_unaligned_stores()
+            return m
+        return self.sub_alignment_by_ids(self.taxon_index.ids(taxon_names))
+
+    def sub_alignment_by_ids(self, ids):
+        """Same as sub_alignment, but takes a sorted array of the taxon IDs
+        assigned by relabel_for_pasta."""
         m = self.new_with_shared_meta()
         for alignment in self:
-            na = alignment.sub_alignment(taxon_names)            
-            m.append(na)
+            if not (isinstance(alignment, AlignmentView) and alignment.taxon_index is self.taxon_index):
+                alignment = AlignmentView(alignment, taxon_index=self.taxon_index)
+            m.append(alignment.sub_alignment_by_ids(ids))
+        m.attach_unaligned_stores()
         return m
+
+    def get_taxon_ids(self):
+        "Returns the sorted array of the IDs of the taxa in any of the loci."
+        ids = set()
+        for el in self:
+            if isinstance(el, AlignmentView) and el.taxon_index is self.taxon_index:
+                ids.update(el.indices)
+            else:
+                ids.update(self.taxon_index.ids(el.keys()))
+        return array('i', sorted(ids))
+
     def get_num_taxa(self):
+        if self.taxon_index is not None and all(isinstance(el, AlignmentView)
+                and el.taxon_index is self.taxon_index for el in self):
+            if len(self) == 1:
+                return len(self[0])
+            return len(self.get_taxon_ids())
         t = set()
         for el in self:
             t.update(set(el.keys()))
@@ -1144,12 +1540,14 @@ class CompactAlignment(dict,object):
     def __init__(self):
         self.colcount = 0
         self.datatype = None
+        self.unaligned_store = None
     
     
     def sub_alignment(self, sub_keys):
         "Creates an new alignment with a subset of the taxa."
-        new_alignment = CompactAlignment()
+        new_alignment = self.__class__()
         new_alignment.datatype = self.datatype
+        new_alignment.unaligned_store = self.unaligned_store
         for key in sub_keys:
             if key in self:
                 new_alignment[key] = self[key]
@@ -1163,6 +1561,9 @@ class CompactAlignment(dict,object):
         return len(self)
     
     def unaligned(self):
+        store = self.unaligned_store
+        if store is not None and store.covers(self):
+            return store.sub_alignment(self, self.datatype)
         n = Alignment()
         n.datatype = self.datatype
         for k,seq in self.items():
@@ -1251,6 +1652,14 @@ class CompactAlignment(dict,object):
         TIMING_LOG.info("transitivitymerge (%d) finished" %ID )
         _LOG.debug("Transitive Merge Finished. ID:%d; cols after: %d" %(ID,self.colcount))
 
+    def merge_in_many(self, shes):
+        '''
+        Merges each alignment in shes inside self, in order. Equivalent to 
+        calling merge_in for each of them.
+        '''
+        for she in shes:
+            self.merge_in(she)
+
     def mask_gapy_sites(self,minimum_seq_requirement):                
         _LOG.debug("Masking alignment sites with fewer than %d characters from alignment with %d columns" 
                    %(minimum_seq_requirement,self.colcount))
@@ -1268,7 +1677,7 @@ class CompactAlignment(dict,object):
         masked = set()
         for seq in self.values():
             for c,i in zip(seq.seq,seq.pos):
-                if c > 'a' and c < 'z':
+                if c >= 'a' and c <= 'z':
                     masked.add(i)
         
         _LOG.debug("%d Columns identified for masking" %len(masked))
@@ -1292,19 +1701,9 @@ class CompactAlignment(dict,object):
                 
         _LOG.debug("Column index mapping calculated.")
         for seq in self.values():
-            # Find ID of char positions that would be masked
-            maskind = [i for i,c in enumerate(seq.pos) if c in masked]
-            n = len(seq.pos)
-            included = [z for z in reduce(lambda x,y: x+[(x[-1][1]+1,y)],maskind,[(-1,-1)]) if z[0]!=z[1]]
-            if not maskind:
-                included.append((0,n))
-            elif (not included or included[-1][1] < n) and maskind[-1]+1 != n:
-                included.append((maskind[-1]+1,n))
-            tmp = []
-            for (i,j) in included:
-                tmp.extend(seq.seq[i:j])
-            seq.seq = "".join(tmp)
-            seq.pos = [colmap[x] for x in (p for p in seq.pos if p not in masked)]
+            kept = [(c, colmap[p]) for c, p in zip(seq.seq, seq.pos) if colmap[p] != -1]
+            seq.seq = "".join(c for c, _ in kept)
+            seq.pos = [p for _, p in kept]
                 
         self.colcount -= off
         _LOG.debug("Masking done. Before masking: %d; After masking: %d;" 
@@ -1324,11 +1723,11 @@ class CompactAlignment(dict,object):
         If duplicate sequence names are encountered then the old name will be replaced.
         """
         if ( file_format.upper() == 'FASTA' ):
-            read_func = read_fasta        
+            read_func = read_fasta_bulk
         elif ( file_format.upper() == 'COMPACT' ):
             read_func = read_compact
         elif ( file_format.upper() == 'COMPACT3' ):
-            read_func = read_compact3
+            read_func = read_compact3_bulk
         else:
             raise NotImplementedError("Unknown file format (%s) is not supported" % file_format)
         self.colcount = 0
@@ -1395,8 +1794,394 @@ class CompactAlignment(dict,object):
             write_func = write_compact_to_fasta
         write_func(self, file_obj)
 
+class ArrayAlignmentSequence(object):
+    """An AlignmentSequence whose residues (uint8) and positions (int32) are
+    slices of numpy buffers that may be shared with other rows.
+
+    The buffers are never modified in place; operations that change a row
+    rebind it to new buffers, so rows shared between alignments (e.g. through
+    sub_alignment) behave like shared AlignmentSequence objects do.
+    """
+    __slots__ = ('residues', 'positions', 'start', 'end')
+
+    def __init__(self, residues, positions, start=0, end=None):
+        self.residues = residues
+        self.positions = positions
+        self.start = start
+        self.end = end
+
+    def get_seq(self):
+        return self.residues[self.start:self.end].tobytes().decode('ascii')
+
+    def set_seq(self, seq):
+        p = self.pos
+        self.residues = numpy.frombuffer(seq.encode('ascii'), dtype=numpy.uint8)
+        self.positions = p
+        self.start, self.end = 0, None
+
+    seq = property(get_seq, set_seq)
+
+    def get_pos(self):
+        return self.positions[self.start:self.end]
+
+    def set_pos(self, pos):
+        r = self.residues[self.start:self.end]
+        self.residues = r
+        self.positions = numpy.asarray(pos, dtype=numpy.int32)
+        self.start, self.end = 0, None
+
+    pos = property(get_pos, set_pos)
+
+    def from_sequence(seq):
+        "Converts an AlignmentSequence to an ArrayAlignmentSequence"
+        return ArrayAlignmentSequence(
+                numpy.frombuffer(seq.seq.encode('ascii'), dtype=numpy.uint8),
+                numpy.asarray(seq.pos, dtype=numpy.int32))
+
+    from_sequence = staticmethod(from_sequence)
+
+    def replace(self, match_char, replace_char):
+        r = self.residues[self.start:self.end].copy()
+        r[r == ord(match_char)] = ord(replace_char)
+        return ArrayAlignmentSequence(r, self.pos)
+
+    def as_string(self, pad_to):
+        pos = self.pos
+        n = int(pos[-1]) + 1 if len(pos) else 0
+        row = numpy.full(max(n, pad_to), _GAP_BYTE, dtype=numpy.uint8)
+        row[pos] = self.residues[self.start:self.end]
+        return row.tobytes().decode('ascii')
+
+    def __str__(self):
+        return self.as_string(0)
+
+    def __repr__(self):
+        return self.__str__()
+
+class ArrayCompactAlignment(CompactAlignment):
+    """A CompactAlignment that keeps all rows in contiguous numpy buffers:
+    one uint8 buffer of residues, one int32 buffer of column positions, and
+    per-taxon offsets into both. Values are ArrayAlignmentSequence views, so
+    the dict-like API of CompactAlignment is preserved.
+
+    Requires numpy; use new_compact_alignment() to get this class when numpy
+    is installed and a plain CompactAlignment otherwise.
+    """
+    def __init__(self):
+        if numpy is None:
+            raise ImportError("numpy is required for ArrayCompactAlignment")
+        CompactAlignment.__init__(self)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, ArrayAlignmentSequence):
+            value = ArrayAlignmentSequence.from_sequence(value)
+        dict.__setitem__(self, key, value)
+
+    def pack(self, keys=None):
+        """Copies the rows for `keys` (all rows by default) into one residue
+        buffer and one position buffer, and rebinds the rows to them.
+
+        Returns (residues, positions, offsets), where row i of `keys` spans
+        offsets[i]:offsets[i+1] of both buffers.
+        """
+        if keys is None:
+            keys = list(self.keys())
+        packed = ArrayCompactAlignment._pack_rows([self[k] for k in keys])
+        self._rebind(keys, *packed)
+        return packed
+
+    def _pack_rows(rows):
+        lengths = numpy.fromiter((len(r.pos) for r in rows), dtype=numpy.int64,
+                                 count=len(rows))
+        offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        if rows:
+            residues = numpy.concatenate([r.residues[r.start:r.end] for r in rows])
+            positions = numpy.concatenate([r.pos for r in rows]).astype(numpy.int32, copy=False)
+        else:
+            residues = numpy.zeros(0, dtype=numpy.uint8)
+            positions = numpy.zeros(0, dtype=numpy.int32)
+        return (residues, positions, offsets)
+
+    _pack_rows = staticmethod(_pack_rows)
+
+    def _rebind(self, keys, residues, positions, offsets):
+        "Points the rows for `keys` to the given buffers."
+        for i, k in enumerate(keys):
+            r = self[k]
+            r.residues = residues
+            r.positions = positions
+            r.start = int(offsets[i])
+            r.end = int(offsets[i+1])
+
+    def column_character_counts(self, seqsubset=None):
+        "Returns a numpy array with the number of characters in each column"
+        if seqsubset is None:
+            seqsubset = list(self.keys())
+        pos = [self[k].pos for k in seqsubset]
+        if not pos:
+            return numpy.zeros(self.colcount, dtype=numpy.int64)
+        return numpy.bincount(numpy.concatenate(pos), minlength=self.colcount)
+
+    def iter_column_character_count(self, seqsubset = None):
+        for c in self.column_character_counts(seqsubset).tolist():
+            yield c
+
+    def get_insertion_columns(self,shared):
+        counts = self.column_character_counts(shared)
+        return set(numpy.flatnonzero(counts == 0).tolist())
+
+    def merge_in(self, she):
+        '''
+        Vectorized version of CompactAlignment.merge_in. Column maps are
+        computed from shared-column counts with cumulative sums, and all 
+        positions are remapped with one gather per buffer. Produces exactly 
+        the same alignment as the column-by-column merge.
+        '''
+        global _T_ID
+        _T_ID += 1
+        ID = _T_ID
+        TIMING_LOG.info("transitivitymerge (%d) started" %ID )
+        mykeys = set(self.keys())
+        _LOG.debug("Transitive Merge Started. ID:%d - Rows: %d,%d" %(ID,len(mykeys),len(she)))
+        shared = [k for k in she.keys() if k in mykeys]
+        _LOG.debug("Shared seq: %d" %(len(shared)))
+        onlyhers = [k for k in she.keys() if k not in mykeys]
+        me_ins = self.column_character_counts(shared) == 0
+        if isinstance(she, ArrayCompactAlignment):
+            she_ins = she.column_character_counts(shared) == 0
+        else:
+            she_ins = numpy.fromiter(she.iter_column_character_count(shared),
+                                     dtype=numpy.int64, count=she.colcount) == 0
+        _LOG.debug("Insertion Columns: %d,%d" %(me_ins.sum(),she_ins.sum()))
+
+        maps = transitivity_column_maps(me_ins, she_ins)
+        if maps is None:
+            _LOG.debug("Shared columns do not match; using column-by-column merge")
+            CompactAlignment.merge_in(self, she)
+            self.pack()
+            return
+        memap, shemap = maps
+
+        self.colcount = len(me_ins) + int(she_ins.sum())
+        mykeys = list(self.keys())
+        residues, positions, offsets = self.pack(mykeys)
+        self._rebind(mykeys, residues, memap[positions], offsets)
+
+        herrows = [she[k] if isinstance(she[k], ArrayAlignmentSequence) 
+                   else ArrayAlignmentSequence.from_sequence(she[k]) for k in onlyhers]
+        residues, positions, offsets = ArrayCompactAlignment._pack_rows(herrows)
+        for k, r in zip(onlyhers, herrows):
+            self[k] = r
+        self._rebind(onlyhers, residues, shemap[positions], offsets)
+        self.pack()
+
+        TIMING_LOG.info("transitivitymerge (%d) finished" %ID )
+        _LOG.debug("Transitive Merge Finished. ID:%d; cols after: %d" %(ID,self.colcount))
+
+    def merge_in_many(self, shes):
+        '''
+        K-way version of merge_in: gives the same result as merging each 
+        alignment in shes in turn, but only the column maps are updated 
+        after each merge; each taxon is remapped and copied once at the end. 
+        '''
+        global _T_ID
+        _T_ID += 1
+        ID = _T_ID
+        TIMING_LOG.info("transitivitymerge (%d) started" %ID )
+        _LOG.debug("K-way Transitive Merge Started. ID:%d - Alignments: %d" %(ID,len(shes)+1))
+        # For each source alignment: [alignment, column map, number of merge 
+        # steps after which the column map is valid, taxa it contributes]
+        sources = [[self, numpy.arange(self.colcount, dtype=numpy.int32), 0, list(self.keys())]]
+        owner = dict((k, 0) for k in self.keys())
+        steps = []
+        colcount = self.colcount
+        for she in shes:
+            shared = [k for k in she.keys() if k in owner]
+            pos = []
+            for k in shared:
+                src = sources[owner[k]]
+                self._update_source_map(src, steps)
+                pos.append(src[1][src[0][k].pos])
+            if pos:
+                me_counts = numpy.bincount(numpy.concatenate(pos), minlength=colcount)
+            else:
+                me_counts = numpy.zeros(colcount, dtype=numpy.int64)
+            if isinstance(she, ArrayCompactAlignment):
+                she_ins = she.column_character_counts(shared) == 0
+            else:
+                she_ins = numpy.fromiter(she.iter_column_character_count(shared),
+                                         dtype=numpy.int64, count=she.colcount) == 0
+            maps = transitivity_column_maps(me_counts == 0, she_ins)
+            if maps is None:
+                self._apply_source_maps(sources, steps, colcount)
+                self.merge_in(she)
+                sources = [[self, numpy.arange(self.colcount, dtype=numpy.int32), 0, list(self.keys())]]
+                owner = dict((k, 0) for k in self.keys())
+                steps = []
+                colcount = self.colcount
+                continue
+            memap, shemap = maps
+            steps.append(memap)
+            colcount = len(memap) + int(she_ins.sum())
+            onlyhers = [k for k in she.keys() if k not in owner]
+            for k in onlyhers:
+                owner[k] = len(sources)
+            sources.append([she, shemap, len(steps), onlyhers])
+        self._apply_source_maps(sources, steps, colcount)
+        TIMING_LOG.info("transitivitymerge (%d) finished" %ID )
+        _LOG.debug("K-way Transitive Merge Finished. ID:%d; cols after: %d" %(ID,self.colcount))
+
+    def _update_source_map(src, steps):
+        "Brings the column map of a merge_in_many source up to the last step"
+        while src[2] < len(steps):
+            src[1] = steps[src[2]][src[1]]
+            src[2] += 1
+
+    _update_source_map = staticmethod(_update_source_map)
+
+    def _apply_source_maps(self, sources, steps, colcount):
+        """Composes the merge steps backwards to map every source to the final
+        columns, then writes each contributed taxon into self once."""
+        final = numpy.arange(colcount, dtype=numpy.int32)
+        by_step = {}
+        for i, src in enumerate(sources):
+            by_step.setdefault(src[2], []).append(i)
+        colmaps = [None] * len(sources)
+        for t in range(len(steps), -1, -1):
+            if t < len(steps):
+                final = final[steps[t]]
+            for i in by_step.get(t, []):
+                colmaps[i] = final[sources[i][1]]
+        for (alg, _, _, keys), colmap in zip(sources, colmaps):
+            rows = [alg[k] if isinstance(alg[k], ArrayAlignmentSequence)
+                    else ArrayAlignmentSequence.from_sequence(alg[k]) for k in keys]
+            residues, positions, offsets = ArrayCompactAlignment._pack_rows(rows)
+            for k, r in zip(keys, rows):
+                self[k] = r
+            self._rebind(keys, residues, colmap[positions], offsets)
+        self.colcount = colcount
+        self.pack()
+
+    def mask_gapy_sites(self,minimum_seq_requirement):
+        _LOG.debug("Masking alignment sites with fewer than %d characters from alignment with %d columns" 
+                   %(minimum_seq_requirement,self.colcount))
+        keep = self.column_character_counts() >= minimum_seq_requirement
+        _LOG.debug("%d Columns identified for masking" %(len(keep) - keep.sum()))
+        self.mask_columns(keep)
+
+    def mask_unaligned_sites(self):
+        _LOG.debug("Masking alignment sites with lower case letters from an alignment with %d sites" 
+                   %(self.colcount))
+        residues, positions, offsets = self.pack()
+        keep = numpy.ones(self.colcount, dtype=bool)
+        keep[positions[(residues >= ord('a')) & (residues <= ord('z'))]] = False
+        _LOG.debug("%d Columns identified for masking" %(len(keep) - keep.sum()))
+        self.mask_columns(keep)
+        return self
+
+    def mask_sites(self, masked):
+        if not masked:
+            return
+        keep = numpy.ones(self.colcount, dtype=bool)
+        keep[numpy.fromiter(masked, dtype=numpy.int64, count=len(masked))] = False
+        self.mask_columns(keep)
+
+    def mask_columns(self, keep):
+        '''
+        Removes the columns for which the boolean array keep is False, in one
+        pass over the packed buffers.
+        '''
+        before = self.colcount
+        if keep.all():
+            return
+        keys = list(self.keys())
+        residues, positions, offsets = self.pack(keys)
+        selected = keep[positions]
+        newcol = (numpy.cumsum(keep) - 1).astype(numpy.int32)
+        counts = numpy.zeros(len(selected) + 1, dtype=numpy.int64)
+        numpy.cumsum(selected, out=counts[1:])
+        self._rebind(keys, residues[selected], newcol[positions[selected]], counts[offsets])
+        self.colcount = int(keep.sum())
+        _LOG.debug("Masking done. Before masking: %d; After masking: %d;" 
+                   %(before,self.colcount))
+
+    def read_file_object(self, file_obj, file_format='FASTA'):
+        """Augments the matrix by reading the file object. FASTA input is 
+        parsed straight into residue and position arrays, without building
+        gapped strings.
+        """
+        if file_format.upper() == 'FASTA':
+            self.colcount = 0
+            for name, seq in read_fasta_bulk(file_obj, as_bytes=True):
+                cseq, l = self.get_alignment_seq_object(seq)
+                self[name] = cseq
+                self.colcount = max(l, self.colcount)
+        else:
+            CompactAlignment.read_file_object(self, file_obj, file_format)
+        self.pack()
+
+    def update_from_alignment(self, alignment):
+        CompactAlignment.update_from_alignment(self, alignment)
+        self.pack()
+
+    def get_alignment_seq_object(self, seq):
+        if isinstance(seq, (str, bytes)):
+            if isinstance(seq, str):
+                seq = seq.encode('ascii')
+            b = numpy.frombuffer(seq, dtype=numpy.uint8)
+            nongap = (b != _GAP_BYTE) & (b != ord('?'))
+            cseq = ArrayAlignmentSequence(b[nongap],
+                    numpy.flatnonzero(nongap).astype(numpy.int32))
+            l = len(seq)
+        else:
+            cseq = ArrayAlignmentSequence(
+                    numpy.frombuffer(seq[0].encode('ascii'), dtype=numpy.uint8),
+                    numpy.asarray(seq[1], dtype=numpy.int32))
+            l = int(seq[1][-1]) + 1
+        return (cseq, l)
+
+def transitivity_column_maps(me_ins, she_ins):
+    """Given boolean arrays marking the insertion columns (columns with no 
+    shared taxa) of two alignments, returns numpy arrays (memap, shemap) that
+    map the columns of each alignment to the columns of their transitivity 
+    merge. Insertion columns of the first alignment are placed before those 
+    of the second one between consecutive shared columns, as in 
+    CompactAlignment.merge_in.
+    
+    Returns None if the two alignments do not have the same number of shared 
+    columns.
+    """
+    me_shared = ~me_ins
+    she_shared = ~she_ins
+    nshared = int(me_shared.sum())
+    if nshared != int(she_shared.sum()):
+        return None
+    # rank of each column: the number of shared columns that precede it
+    me_rank = numpy.cumsum(me_shared) - me_shared
+    she_rank = numpy.cumsum(she_shared) - she_shared
+    # number of insertion columns with rank <= r, for each r
+    me_ins_upto = numpy.cumsum(numpy.bincount(me_rank[me_ins], minlength=nshared+1))
+    she_ins_upto = numpy.cumsum(numpy.bincount(she_rank[she_ins], minlength=nshared+1))
+    she_ins_before = numpy.concatenate(([0], she_ins_upto[:-1]))
+    memap = numpy.arange(len(me_ins)) + numpy.where(me_ins, 
+            she_ins_before[me_rank], she_ins_upto[me_rank])
+    shemap = numpy.arange(len(she_ins)) + me_ins_upto[she_rank]
+    return (memap.astype(numpy.int32), shemap.astype(numpy.int32))
+
+def new_compact_alignment():
+    """Returns an empty ArrayCompactAlignment if numpy is available, and an
+    empty CompactAlignment otherwise."""
+    if numpy is not None:
+        return ArrayCompactAlignment()
+    return CompactAlignment()
+
 def compact(alg):
-    comp = CompactAlignment()
+    if isinstance(alg, AlignmentView):
+        alg = alg.materialize()
+    if isinstance(alg, CompactAlignment):
+        return alg
+    comp = new_compact_alignment()
     comp.update_from_alignment(alg)
     return comp
 
@@ -14,6 +14,7 @@ import sys
 import re
 import tempfile
 import shutil
+import hashlib
 from threading import Lock
 from pasta import get_logger
 _LOG = get_logger(__name__)
@@ -254,6 +255,117 @@ class TempFS(object):
         in_common = os.path.commonprefix([self._top_level_temp_real, real_path])
         return in_common == self._top_level_temp_real
 
+class ResultCache(object):
+    '''A persistent, size-bounded store of the output files of external tools.
+
+    Entries are keyed by a hash of the tool invocation and the bytes of its
+    input files (see `key`), so a subproblem that was already solved in an
+    earlier iteration (or an earlier run) can be answered without running the
+    tool.  When the total size exceeds `max_mb`, the least recently used
+    entries are removed.  Files are written atomically, so several PASTA runs
+    can share one cache directory.
+    '''
+    def __init__(self, directory, max_mb=1024):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_mb) * 1024 * 1024
+        self._lock = Lock()
+        self._total_bytes = None
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, parts, input_paths=()):
+        "Returns a hex digest of the strings in `parts` and of the contents of `input_paths`."
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode('utf-8'))
+            h.update(b'\0')
+        for path in input_paths:
+            f = open(path, 'rb')
+            try:
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+            finally:
+                f.close()
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        "Returns (mtime, size, path) for every cached file."
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for fn in filenames:
+                if fn.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def fetch(self, key, dest):
+        """Copies the entry for `key` to `dest` and returns True, or returns
+        False if there is no such entry."""
+        path = self._entry_path(key)
+        self._lock.acquire()
+        try:
+            try:
+                os.utime(path, None)
+                shutil.copyfile(path, dest)
+            except (IOError, OSError):
+                return False
+        finally:
+            self._lock.release()
+        _LOG.debug("result cache hit %s" % key)
+        return True
+
+    def put(self, key, src):
+        "Stores a copy of the file `src` as the entry for `key`."
+        path = self._entry_path(key)
+        d = os.path.dirname(path)
+        self._lock.acquire()
+        try:
+            if not os.path.exists(d):
+                os.makedirs(d)
+            fd, tmp = tempfile.mkstemp(dir=d, prefix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, path)
+            except:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            if self._total_bytes is None:
+                self._total_bytes = sum(e[1] for e in self._entries())
+            else:
+                self._total_bytes += os.path.getsize(path)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._total_bytes = total
+
 class PastaProducts(object):
     """
     Handles paths to all (final) output produced by PASTA.
@@ -32,7 +32,7 @@ from pasta import filemgr
 from pasta.alignment import MultiLocusDataset, compact
 from pasta.configure import get_configuration
 from pasta.pastajob import *
-from pasta.scheduler import  stop_worker
+from pasta.scheduler import  stop_worker, set_executor
 from pasta.tools import *
 from pasta.treeholder import read_and_encode_splits,\
     generate_tree_with_splits_from_tree
@@ -173,6 +173,7 @@ def finish_pasta_execution(pasta_team,
     # Launch threads to do work
     #####
     pasta_config = user_config.get("sate")
+    set_executor(pasta_config.job_executor)
     start_worker(pasta_config.num_cpus)
     
     
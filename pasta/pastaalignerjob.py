@@ -21,11 +21,12 @@
 
 import os
 import copy
+import itertools
 from threading import Lock
 from pasta import get_logger
 from pasta.tree import PhylogeneticTree
 from dendropy.datamodel.treemodel import Tree
-from pasta.alignment import  CompactAlignment
+from pasta.alignment import compact
 _LOG = get_logger(__name__)
 
 from pasta.treeholder import TreeHolder
@@ -68,6 +69,31 @@ def bisect_tree(tree, breaking_edge_style='mincluster',min_size=0,max_size=None,
     assert snl == tree1.n_leaves + tree2.n_leaves
     return tree1, tree2
 
+def estimate_sequence_length(alignment, sample_size=10):
+    """Average number of residues in (up to `sample_size`) sequences of
+    `alignment`; used only to rank jobs by their expected cost."""
+    store = getattr(alignment, 'unaligned_store', None)
+    lengths = []
+    for name in itertools.islice(iter(alignment), sample_size):
+        if store is not None and name in store:
+            lengths.append(len(store[name]))
+            continue
+        seq = alignment[name]
+        if hasattr(seq, 'seq'):
+            lengths.append(len(seq.seq))
+        else:
+            lengths.append(len(seq) - seq.count('-') - seq.count('?'))
+    if not lengths:
+        return 0
+    return sum(lengths) / float(len(lengths))
+
+def estimate_alignment_cost(num_taxa, seq_len):
+    "Relative cost of aligning `num_taxa` sequences of length `seq_len` (all pairs)."
+    return float(num_taxa) * num_taxa * seq_len
+
+def estimate_merge_cost(num_taxa1, num_taxa2, seq_len):
+    "Relative cost of a profile-profile merge of two alignments with `seq_len` columns."
+    return float(num_taxa1 + num_taxa2) * seq_len * seq_len
 
 class PASTAAlignerJob(TreeHolder, TickableJob):
     """A class that performs one alignment in the PASTA algorithm.
@@ -140,6 +166,32 @@ class PASTAAlignerJob(TreeHolder, TickableJob):
     def postprocess(self):
         self.tick_praents()
 
+    def _subset_size_and_length(self):
+        n = self.multilocus_dataset.get_num_taxa()
+        if not self.multilocus_dataset:
+            return n, 0
+        return n, estimate_sequence_length(self.multilocus_dataset[0])
+
+    def pending_merge_cost(self):
+        """Estimated cost of the merger job this job will queue once its
+        subjobs are done (0 if it has queued it already, or never merges)."""
+        if self.skip_merge or self.merge_job_list or self.align_job_list:
+            return 0
+        s1, s2 = self.subjob1, self.subjob2
+        if s1 is None or s2 is None:
+            return 0
+        n1, l1 = s1._subset_size_and_length()
+        n2, l2 = s2._subset_size_and_length()
+        return estimate_merge_cost(n1, n2, max(l1, l2))
+
+    def remaining_critical_path(self):
+        """Estimated length of the longest chain of queued work that can only
+        start once this job is finished (see scheduler.job_critical_path)."""
+        cp = 0
+        for parent in list(self._parents):
+            cp = max(cp, parent.pending_merge_cost() + parent.remaining_critical_path())
+        return cp
+
     def on_dependency_ready(self):
         ''' This is called when the "child" jobs are finished. 
         If self is a "alignment" subproblem, we just need to tick the parent job(s).
@@ -194,6 +246,8 @@ class PASTAAlignerJob(TreeHolder, TickableJob):
                                                   delete_temps=self.delete_temps,
                                                   context_str=cs)
             mj.add_parent_tickable_job(self)
+            mj.estimated_cost = estimate_merge_cost(r1.get_num_taxa(), r2.get_num_taxa(),
+                                                    max(r1.sequence_length(), r2.sequence_length()))
             self.add_child(mj)
                         
             if self.killed:
@@ -256,6 +310,7 @@ class PASTAAlignerJob(TreeHolder, TickableJob):
 
         if self.expected_number_of_taxa <= self.max_subproblem_size:
             _LOG.debug("%s...Calling Aligner" % prefix)
+            self.multilocus_dataset.attach_unaligned_stores()
             aj_list = []
             for index, single_locus_sd in enumerate(self.multilocus_dataset):
                 aj = self.pasta_team.aligner.create_job(single_locus_sd,
@@ -263,6 +318,8 @@ class PASTAAlignerJob(TreeHolder, TickableJob):
                                                        delete_temps=self.delete_temps,
                                                        context_str=self.context_str + " align" + str(index))
                 aj.add_parent_tickable_job(self)
+                aj.estimated_cost = estimate_alignment_cost(single_locus_sd.get_num_taxa(),
+                                                            estimate_sequence_length(single_locus_sd))
                 self.add_child(aj)
                 
                 aj_list.append(aj)
@@ -576,16 +633,14 @@ class PASTAMergerJob(PASTAAlignerJob):
                 if self.skip_merge:
                     r = self.multilocus_dataset.new_with_shared_meta()
                     r.append(j_list[0].get_results()[0]) #TODO: this should be changed to be multi-locus
+                    r[0].merge_in_many([j.get_results()[0] for j in j_list[1:]]) #TODO: this should be changed to be multi-locus
                     for j in j_list[1:]:
-                        r[0].merge_in(j.get_results()[0]) #TODO: this should be changed to be multi-locus
-                        j.clear_results_object()                        
+                        j.clear_results_object()
                     #assert all(x.is_aligned() for x in r)
                 else: # These are pairwise merges
                     r = self.multilocus_dataset.new_with_shared_meta()
                     for j in j_list:
-                        a = CompactAlignment()
-                        a.update_from_alignment(j.get_results())
-                        r.append(a)
+                        r.append(compact(j.get_results()))
                 self.result_alignment = r
                 self.finished = True
             else:
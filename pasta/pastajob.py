@@ -37,8 +37,8 @@ from pasta.treeholder import TreeHolder, resolve_polytomies,\
 from pasta.pastaalignerjob import PASTAAlignerJob, PASTAMergerJob
 from pasta import get_logger
 from pasta.utility import record_timestamp
-from pasta.scheduler import jobq
-from pasta.filemgr import  TempFS
+from pasta.scheduler import jobq, reset_makespan, report_makespan
+from pasta.filemgr import  TempFS, ResultCache
 from pasta import TEMP_SEQ_ALIGNMENT_TAG, TEMP_TREE_TAG, MESSENGER, TEMP_SHRUNK_ALIGNMENT_TAG, TEMP_SHRUNK_TREE_TAG
 
 # uym2 added: for minimum subsets tree
@@ -58,11 +58,17 @@ class PastaTeam (object):
         try:
             max_mem_mb = config.sate.max_mem_mb
             self._temp_fs = TempFS()
+            self.result_cache = None
+            if config.sate.result_cache_dir:
+                self.result_cache = ResultCache(config.sate.result_cache_dir,
+                                                config.sate.result_cache_max_mb)
             self.aligner = config.create_aligner(temp_fs=self._temp_fs)
             self.aligner.max_mem_mb = max_mem_mb
+            self.aligner.result_cache = self.result_cache
             self.hmmeralign = config.create_aligner(temp_fs=self._temp_fs, name = "hmmeralign")
             self.merger = config.create_merger(temp_fs=self._temp_fs)
             self.merger.max_mem_mb = max_mem_mb
+            self.merger.result_cache = self.result_cache
             self.tree_estimator = config.create_tree_estimator(temp_fs=self._temp_fs)
             self.raxml_tree_estimator = config.create_tree_estimator(name='Raxml', temp_fs=self._temp_fs)
             self.subsets = {} # needed for pastamerger
@@ -508,6 +514,7 @@ WARNING: you have specified a max subproblem ({0}) that is equal to or greater
                 if self.killed:
                     raise RuntimeError("PASTA Job killed")
                 tree_for_aligner = self.get_tree_copy()
+                reset_makespan()
                 aligner = PASTAAlignerJob(multilocus_dataset=self.multilocus_dataset,
                                          pasta_team=self.pasta_team,
                                          tree=tree_for_aligner,
@@ -553,6 +560,7 @@ WARNING: you have specified a max subproblem ({0}) that is equal to or greater
                     new_multilocus_dataset = aligner.get_results()
                 
                 _LOG.debug("Alignment obtained. Preparing for tree.")
+                report_makespan(context_str + " alignment")
                 self.pasta_aligner_job = None
                 del aligner
 
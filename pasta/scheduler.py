@@ -21,6 +21,9 @@
 # Jiaye Yu and Mark Holder, University of Kansas
 
 import os
+import time
+import heapq
+import itertools
 import traceback
 from io import StringIO
 from io import BytesIO
@@ -28,7 +31,8 @@ try:
     from queue import Queue
 except ImportError:
     from Queue import Queue
-from threading import Thread, Event, Lock
+from threading import Thread, Event, Lock, Condition
+from collections import deque
 from multiprocessing import Process, Manager, Value
 from subprocess import Popen, PIPE
 from pasta import get_logger, TIMING_LOG
@@ -37,16 +41,167 @@ from random import random
 
 _LOG = get_logger(__name__)
 
+def job_critical_path(job):
+    """Estimated length (in the relative cost units of `estimated_cost`) of
+    the longest chain of work that starts with `job`: its own cost plus the
+    largest remaining critical path of the jobs waiting on it. Jobs that are
+    not part of the alignment/merge DAG just get their own cost (so they are
+    scheduled longest-processing-time first), or 0 if it is unknown."""
+    cp = 0
+    for parent in getattr(job, 'parent_tickable_job', ()):
+        if hasattr(parent, 'remaining_critical_path'):
+            cp = max(cp, parent.remaining_critical_path())
+    return getattr(job, 'estimated_cost', 0) + cp
+
 class LoggingQueue(Queue):
+    """The job queue. Jobs come out in decreasing order of their estimated
+    critical path (see `job_critical_path`), and in FIFO order among equals."""
+    def _init(self, maxsize):
+        self.queue = []
+        self._counter = itertools.count()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        heapq.heappush(self.queue, item)
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
     def put(self, job):
         TIMING_LOG.info("%s queued" % str(job.context_str))
         _LOG.debug("%s queued" % str(job.context_str))
-        Queue.put(self, job)
+        job.critical_path = job_critical_path(job)
+        Queue.put(self, (-job.critical_path, next(self._counter), job))
 
 jobq = LoggingQueue()
 
+class MakespanTracker(object):
+    """Records the estimated cost, critical path and run time of every job
+    run by the workers, so that the makespan projected from the estimates
+    can be compared to the actual one (see `report_makespan`)."""
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        self.records = []
+        self._lock.release()
+
+    def record(self, job, start, end):
+        self._lock.acquire()
+        self.records.append((getattr(job, 'estimated_cost', 0), getattr(job, 'critical_path', 0), start, end))
+        self._lock.release()
+
+    def makespans(self, num_workers):
+        """Returns (projected, actual) makespan in seconds, or None if no job
+        with a cost estimate was run. Estimates are converted to seconds
+        using the observed seconds-per-cost-unit of the jobs that ran."""
+        self._lock.acquire()
+        records = list(self.records)
+        self._lock.release()
+        costed = [r for r in records if r[0] > 0]
+        if not costed:
+            return None
+        total_cost = sum(r[0] for r in costed)
+        rate = sum(r[3] - r[2] for r in costed) / float(total_cost)
+        longest_path = max(r[1] for r in costed)
+        projected = rate * max(longest_path, total_cost / float(max(1, num_workers)))
+        actual = max(r[3] for r in records) - min(r[2] for r in records)
+        return projected, actual
+
+_makespan_tracker = MakespanTracker()
+
+def reset_makespan():
+    _makespan_tracker.reset()
+
+def report_makespan(label):
+    """Writes the projected and actual makespan of the jobs run since the
+    last `reset_makespan` call to the timing log, and returns them."""
+    m = _makespan_tracker.makespans(len(_WORKER_THREADS))
+    if m is not None:
+        TIMING_LOG.info("%s projected makespan %.2f s, actual makespan %.2f s" % (label, m[0], m[1]))
+        _LOG.debug("%s projected makespan %.2f s, actual makespan %.2f s" % (label, m[0], m[1]))
+    _makespan_tracker.reset()
+    return m
+
+class CpuSlots(object):
+    """Keeps count of the cores used by the running jobs so that their
+    threads add up to at most `total` (the num_cpus budget). Slots are handed
+    out in the order they are asked for, so a job that needs many cores is
+    not starved by a stream of single-threaded ones."""
+    def __init__(self, total=1):
+        self._cond = Condition()
+        self._waiting = deque()
+        self.total = total
+        self.in_use = 0
+
+    def set_total(self, total):
+        self._cond.acquire()
+        self.total = max(1, total)
+        self._cond.notify_all()
+        self._cond.release()
+
+    def acquire(self, n):
+        """Blocks until `n` slots (at most `total`) are free, takes them, and
+        returns how many were taken."""
+        ticket = object()
+        self._cond.acquire()
+        try:
+            n = max(0, min(n, self.total))
+            self._waiting.append(ticket)
+            while self._waiting[0] is not ticket or self.in_use + n > self.total:
+                self._cond.wait()
+            self._waiting.popleft()
+            self.in_use += n
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+        return n
+
+    def acquire_free(self, n):
+        """Takes up to `n` of the slots that are free and not waited for,
+        without blocking. Returns how many were taken."""
+        self._cond.acquire()
+        try:
+            if self._waiting:
+                return 0
+            n = max(0, min(n, self.total - self.in_use))
+            self.in_use += n
+        finally:
+            self._cond.release()
+        return n
+
+    def release(self, n):
+        self._cond.acquire()
+        self.in_use -= n
+        self._cond.notify_all()
+        self._cond.release()
+
+_cpu_slots = CpuSlots()
+
 _all_dispatchable_jobs = []
 
+# How the worker threads run the invocation of a DispatchableJob:
+#   'process' -- hand it to a helper process (one per worker) through a
+#                Manager queue, which calls Popen;
+#   'direct'  -- call Popen and wait on the child from the worker thread.
+EXECUTORS = ('process', 'direct')
+_EXECUTOR = 'process'
+
+def set_executor(name):
+    """Selects the executor used by worker threads started after this call."""
+    global _EXECUTOR
+    name = name.lower()
+    if name not in EXECUTORS:
+        raise ValueError("Unknown job executor '%s' (expecting one of %s)" % (name, ", ".join(EXECUTORS)))
+    _EXECUTOR = name
+
+def get_executor():
+    return _EXECUTOR
+
 merged_queue_events = []
 
 def new_merge_event():
@@ -101,8 +256,9 @@ class LightJobForProcess():
             _stderr_fo = open_with_intermediates(os.path.join(proc_cwd, '.Job.stderr.txt'), 'w')
         k['stderr'] = _stderr_fo
 
-        for key,v in self.environ.items():
-            os.environ[key] = v
+        if self.environ is not None:
+            for key,v in self.environ.items():
+                os.environ[key] = v
 
         process = Popen(self._invocation, stdin = PIPE, universal_newlines=True, **k)
 
@@ -153,12 +309,16 @@ class pworker():
 class worker():
     
     def __init__(self, i):
+        self.i = i
+        self.executor = _EXECUTOR
+        self.p = None
+        if self.executor != 'process':
+            return
         global _manager
         try:
             _manager
         except NameError:
             _manager = Manager()
-        self.i = i
         self.pqueue = _manager.Queue()
         self.err_shared_obj = Value('i', 0)
         pw = pworker(self.i, self.pqueue, self.err_shared_obj)
@@ -167,27 +327,56 @@ class worker():
         self.p.start()
 
     def stop(self):
-        self.p.terminate()
+        if self.p is not None:
+            self.p.terminate()
+
+    def _run_in_process(self, pa):
+        shared_job_obj = [pa[0],pa[1],dict(os.environ),None]
+        self.pqueue.put(shared_job_obj)
+        _LOG.debug("Worker %d put a job tuple on queue %s" %(self.i,str(self.pqueue)))
+        
+        self.pqueue.join()   
+
+        _LOG.debug("Worker %d joined on queue %s" %(self.i,str(self.pqueue)))
+        
+        plj = LightJobForProcess(shared_job_obj[0],shared_job_obj[1],shared_job_obj[2])
+        plj.error = shared_job_obj[3]
+        plj.return_code = self.err_shared_obj.value
+        return plj
+
+    def _acquire_slots(self, job):
+        """Waits for the cores `job` declared. A job whose thread count can be
+        changed also gets the idle cores if nothing else is queued behind it."""
+        slots = _cpu_slots.acquire(job.num_threads)
+        if job.thread_option is not None and jobq.empty():
+            extra = _cpu_slots.acquire_free(_cpu_slots.total)
+            if extra:
+                slots += extra
+                job.set_threads(slots)
+                _LOG.debug("%s given %d threads" % (str(job.context_str), slots))
+        return slots
+
+    def _run_directly(self, pa):
+        plj = LightJobForProcess(pa[0], pa[1], None)
+        plj.run()
+        return plj
         
     def __call__(self):                            
         while True:            
             job = jobq.get()            
             ID=int(random() *10000000)
+            slots = 0
+            if isinstance(job, DispatchableJob):
+                slots = self._acquire_slots(job)
             TIMING_LOG.info("%s (%d) started" % (str(job.context_str),ID))
+            started = time.time()
             try:
                 if isinstance(job, DispatchableJob):
                     pa = job.start()
-                    shared_job_obj = [pa[0],pa[1],dict(os.environ),None]
-                    self.pqueue.put(shared_job_obj)
-                    _LOG.debug("Worker %d put a job tuple on queue %s" %(self.i,str(self.pqueue)))
-                    
-                    self.pqueue.join()   
-
-                    _LOG.debug("Worker %d joined on queue %s" %(self.i,str(self.pqueue)))
-                    
-                    plj = LightJobForProcess(shared_job_obj[0],shared_job_obj[1],shared_job_obj[2])
-                    plj.error = shared_job_obj[3]
-                    plj.return_code = self.err_shared_obj.value
+                    if self.executor == 'direct':
+                        plj = self._run_directly(pa)
+                    else:
+                        plj = self._run_in_process(pa)
                                              
                     if plj.error is not None:
                         job.error = Exception(plj.error)
@@ -217,6 +406,9 @@ class worker():
                 job.kill()
                 kill_all_jobs()
                 return                
+            finally:
+                _cpu_slots.release(slots)
+            _makespan_tracker.record(job, started, time.time())
             TIMING_LOG.info("%s (%d) completed" % (str(job.context_str),ID))
             jobq.task_done()
         return
@@ -234,6 +426,7 @@ def start_worker(num_workers):
     (worker threads are never killed).
     """
     assert num_workers > 0, "A positive number must be passed as the number of worker threads"
+    _cpu_slots.set_total(max(num_workers, _cpu_slots.total))
     num_currently_running = len(_WORKER_THREADS)
     for i in range(num_currently_running, num_workers):
         _LOG.debug("Launching Worker thread #%d" % i)
@@ -257,8 +450,17 @@ class JobBase(object):
 
 
 class DispatchableJob(JobBase):
+    """A job that runs `invocation` as a child process.
+
+    `num_threads` is the number of cores the process will use; a worker waits
+    until that many of the num_cpus slots are free before running it. If
+    `thread_option` is given, the argument that follows it in `invocation` is
+    the thread count, and the worker may raise it to use idle cores.
+    """
     def __init__(self, invocation, result_processor, **kwargs):
         global _all_dispatchable_jobs
+        self.num_threads = kwargs.pop('num_threads', 1)
+        self.thread_option = kwargs.pop('thread_option', None)
         JobBase.__init__(self, **kwargs)
         self._invocation = invocation
         # _LOG.debug('DispatchableJob.__init__(invocation= %s )' % " ".join(self._invocation))  # Not sure why it does not work with datatype in treebuild.create_job
@@ -280,6 +482,11 @@ class DispatchableJob(JobBase):
 
     id = property(get_id, set_id)
 
+    def set_threads(self, n):
+        i = self._invocation.index(self.thread_option)
+        self._invocation[i + 1] = str(n)
+        self.num_threads = n
+
     def start(self):
         try:
             #_LOG.debug('launching %s.\n setting event' % " ".join(self._invocation))            
@@ -101,6 +101,9 @@ class PastaUserSettings(UserSettingsContainer):
         self.commandline.add_option('auto', BoolUserSetting(name='auto', default='False', short_name=None, help='This option is mostly for backward compatibility. If used, then automatically identified default values for the max_subproblem_size, number of cpus, tools, breaking strategy, masking criteria, and stopping criteria will be used. This is just like using the default options. However, [WARNING] when auto option is used PASTA overrides the value of these options even if you have supplied them; we recommend that you run this option with --exportconfig to see the exact set of options that will be used in your analysis.', subcategory=None))
         self.sate.add_option('num_cpus', IntUserSetting(name='num_cpus', default=1, min=1, max=None, short_name=None, help='The number of processing cores that you would like to assign to PASTA.  This number should not exceed the number of cores on your machine. [default: number of cores available on the machine]', subcategory='platform'))
         self.sate.add_option('max_mem_mb', IntUserSetting(name='max_mem_mb', default=1024, min=256, max=None, short_name=None, help='The maximum memory available to OPAL (for the Java heap size when running Java tools).', subcategory='platform'))
+        self.sate.add_option('job_executor', ChoiceUserSetting(name='job_executor', default='process', choices=['process', 'direct'], multiple_choices=False, short_name=None, help='How external tools are launched. "process" runs them through one helper process per CPU; "direct" starts and waits on them from the scheduler threads, which avoids the helper processes and the per-job queue round trip. [default: process]', subcategory='platform'))
+        self.sate.add_option('result_cache_dir', StringUserSetting(name='result_cache_dir', default=None, short_name=None, help='If given, the outputs of the aligner and merger are cached (keyed by a hash of the tool invocation and input sequences) in this directory and reused whenever the same subproblem is seen again, in this or a later run. [default: disabled]', subcategory='platform'))
+        self.sate.add_option('result_cache_max_mb', IntUserSetting(name='result_cache_max_mb', default=2048, min=1, max=None, short_name=None, help='The maximum size of the result cache directory; least recently used results are removed beyond this size. [default: 2048]', subcategory='platform'))
         self.sate.add_option('aligner', StringUserSetting(name='aligner', default='mafft', short_name=None, help='The name of the alignment program to use for subproblems. [default: mafft]', subcategory='tools'))
         self.sate.add_option('merger', StringUserSetting(name='merger', default='opal', short_name=None, help='The name of the alignment program to use to merge subproblems. [default: OPAL]', subcategory='tools'))
         self.sate.add_option('tree_estimator', StringUserSetting(name='tree_estimator', default='fasttree', short_name=None, help='The name of the tree inference program to use to find trees on fixed alignments. [default: fasttree]', subcategory='tools'))
@@ -5,13 +5,17 @@ import datetime
 import logging
 import sys
 import os
+import shutil
+import tempfile
 
 from pasta.test import get_testing_configuration, data_source_path, TestLevel, is_test_enabled
 
 from pasta import get_logger
-from pasta.alignment import Alignment
+from pasta.alignment import Alignment, CompactAlignment
 from pasta.scheduler import jobq, start_worker
-from pasta.filemgr import TempFS
+from pasta.filemgr import TempFS, ResultCache
+from pasta.tools import PadAligner
+from pasta.scheduler import FakeJob
 
 _LOG = get_logger(__name__)
 
@@ -52,6 +56,11 @@ your installation is not configured to run this tool.
                     tmp_dir_par=self.ts.top_level_temp,
                     delete_temps=True)
 
+        if isinstance(a, CompactAlignment):
+            t = Alignment()
+            a.update_dict_from(t)
+            a = t
+
         reference_fn = data_source_path('%s.%s' % (name, fn))
         reference_aln = Alignment()
         reference_aln.read_filepath(reference_fn, 'FASTA')
@@ -84,6 +93,27 @@ your installation is not configured to run this tool.
         if is_test_enabled(TestLevel.EXHAUSTIVE, _LOG):
             self._impl_test_aligner('mafft', 'anolis.fasta')
 
+    def testResultCache(self):
+        filename = data_source_path('small.fasta')
+        alignment = Alignment()
+        alignment.datatype = 'DNA'
+        alignment.read_filepath(filename, 'FASTA')
+        aln = PadAligner(self.ts, path=filename)
+        cache_dir = tempfile.mkdtemp(prefix='resultcache')
+        self.addCleanup(shutil.rmtree, cache_dir)
+        aln.result_cache = ResultCache(cache_dir)
+        job = aln.create_job(alignment, tmp_dir_par=self.ts.top_level_temp, delete_temps=True)
+        self.assertFalse(isinstance(job, FakeJob))
+        # pretend the tool ran, and read its output
+        shutil.copyfile(filename, os.path.join(job._kwargs['cwd'], 'input.aligned'))
+        first = job.result_processor()
+        job = aln.create_job(alignment, tmp_dir_par=self.ts.top_level_temp, delete_temps=True)
+        self.assertTrue(isinstance(job, FakeJob))
+        second = job.get_results()
+        self.assertEqual(sorted(first.keys()), sorted(second.keys()))
+        for k in first.keys():
+            self.assertEqual(first.as_string_sequence(k), second.as_string_sequence(k))
+
 
 
 
@@ -4,11 +4,14 @@ import unittest
 import datetime
 import logging
 import os
+import copy
 
 from io import StringIO
 from pasta import get_logger
 from pasta.alignment import Alignment, SequenceDataset, MultiLocusDataset,\
-    merge_in
+    merge_in, CompactAlignment, ArrayCompactAlignment, numpy,\
+    transitivity_column_maps, read_fasta, read_fasta_bulk, read_compact3,\
+    read_compact3_bulk, UnalignedSequenceStore, AlignmentView
 from pasta.treeholder import read_and_encode_splits
 
 from pasta.test import get_testing_configuration, data_source_path, TestLevel, is_test_enabled
@@ -41,6 +44,88 @@ class AlignmentTest(unittest.TestCase):
         a.read_filepath(filename1, 'FASTA')
         b.read_filepath(filename2, 'FASTA')
 
+    def testBulkReaders(self):
+        filename = data_source_path('small.fasta')
+        expected = list(read_fasta(open(filename, 'r')))
+        self.assertEqual(list(read_fasta_bulk(filename)), expected)
+        self.assertEqual(list(read_fasta_bulk(open(filename, 'r'))), expected)
+        alignment = Alignment()
+        alignment.read_filepath(filename, 'FASTA')
+        compact3 = StringIO()
+        alignment.write(compact3, 'COMPACT3')
+        self.assertEqual(list(read_compact3_bulk(StringIO(compact3.getvalue()))),
+                         list(read_compact3(StringIO(compact3.getvalue()))))
+        bad = StringIO('>a\nACGT\nAC1T\n')
+        self.assertRaises(Exception, list, read_fasta_bulk(bad))
+
+    def testMaskGapySites(self):
+        a = Alignment()
+        a['1'] = 'A--CG--T'
+        a['2'] = 'AC----GT'
+        a['3'] = 'A-C-G-T-'
+        a['4'] = 'ACGT---T'
+        a.mask_gapy_sites(2)
+        self.assertEqual(a['1'], 'A--CG-T')
+        self.assertEqual(a['3'], 'A-C-GT-')
+
+    def testUnalignedStore(self):
+        a = Alignment()
+        a.datatype = 'DNA'
+        a['1'] = 'A--CG--T'
+        a['2'] = '--------'
+        a['3'] = 'A-C-G-T-'
+        store = UnalignedSequenceStore.from_alignment(a)
+        self.assertRaises(TypeError, store.__setitem__, '1', 'ACGT')
+        self.assertTrue(copy.deepcopy(store) is store)
+        a.unaligned_store = store
+        a['1'] = 'AC--G--T'
+        sub = a.sub_alignment(['1', '2'])
+        self.assertTrue(sub.unaligned_store is store)
+        u = sub.unaligned()
+        self.assertEqual(dict(u), {'1': 'ACGT'})
+        self.assertEqual(u.datatype, 'DNA')
+        a['4'] = 'G-G'
+        self.assertEqual(a.unaligned()['4'], 'GG')
+
+    def testAlignmentView(self):
+        a = Alignment()
+        a.datatype = 'DNA'
+        a.read_filepath(data_source_path('small.fasta'), 'FASTA')
+        names = list(a.keys())
+        view = AlignmentView(a).sub_alignment(names[:10] + ['missing'])
+        self.assertEqual(view.get_num_taxa(), 10)
+        sub = view.sub_alignment(names[5:20])
+        self.assertEqual(sorted(sub.keys()), sorted(names[5:10]))
+        self.assertTrue(sub.taxon_index is view.taxon_index)
+        self.assertFalse(names[0] in sub)
+        self.assertEqual(dict(sub.unaligned()), dict(a.sub_alignment(names[5:10]).unaligned()))
+        out = StringIO()
+        sub.write(out, 'FASTA')
+        self.assertEqual(dict(read_fasta(StringIO(out.getvalue()))), dict(sub.materialize()))
+        c = CompactAlignment()
+        c.update_from_alignment(a)
+        m = MultiLocusDataset([c]).sub_alignment(names[:3])
+        self.assertTrue(isinstance(m[0], AlignmentView))
+        self.assertTrue(isinstance(m[0].materialize(), CompactAlignment))
+        self.assertEqual(m.get_num_taxa(), 3)
+
+    def testTaxonIds(self):
+        filename = data_source_path('small.fasta')
+        md = MultiLocusDataset()
+        md.read_files([filename, filename], 'DNA')
+        md.relabel_for_pasta()
+        names = list(md[0].keys())
+        self.assertEqual(len(md.taxon_index), 32)
+        self.assertEqual(md.taxon_index.labels(md.taxon_index.ids(names[:4])), names[:4])
+        half = md.sub_alignment(names[:16])
+        self.assertTrue(half.taxon_index is md.taxon_index)
+        self.assertEqual(half.get_num_taxa(), 16)
+        quarter = half.sub_alignment_by_ids(md.taxon_index.ids(names[8:24]))
+        self.assertEqual(list(quarter.get_taxon_ids()), list(md.taxon_index.ids(names[8:16])))
+        self.assertEqual(quarter.get_num_taxa(), 8)
+        for el in quarter:
+            self.assertEqual(sorted(el.keys()), sorted(names[8:16]))
+
     def testMaxSequenceLength(self):
         a = Alignment()
         a['1'] = 'A--CG--T'
@@ -49,6 +134,94 @@ class AlignmentTest(unittest.TestCase):
         a['4'] = 'ACGT---T'
         self.assertEqual(a.max_sequence_length(), 5)
             
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class ArrayCompactAlignmentTest(unittest.TestCase):
+    def _read_pair(self, filename):
+        a = Alignment()
+        a.read_filepath(data_source_path(filename), 'FASTA')
+        c = CompactAlignment()
+        c.update_from_alignment(a)
+        n = ArrayCompactAlignment()
+        n.update_from_alignment(a)
+        return (a, c, n)
+
+    def assertSameCompact(self, c, n):
+        self.assertEqual(c.colcount, n.colcount)
+        self.assertEqual(sorted(c.keys()), sorted(n.keys()))
+        for k in c.keys():
+            self.assertEqual(c.as_string_sequence(k), n.as_string_sequence(k))
+
+    def testRoundTrip(self):
+        a, c, n = self._read_pair('small.fasta')
+        self.assertSameCompact(c, n)
+        for k in a.keys():
+            self.assertEqual(a[k], n.as_string_sequence(k))
+            self.assertEqual(c[k].seq, n[k].seq)
+        self.assertEqual(list(c.iter_column_character_count()),
+                         list(n.iter_column_character_count()))
+        out = StringIO()
+        n.write(out, 'COMPACT3')
+        out.seek(0)
+        r = ArrayCompactAlignment()
+        r.read_file_object(out, 'COMPACT3')
+        self.assertSameCompact(n, r)
+
+    def testReadFasta(self):
+        a, c, n = self._read_pair('small.fasta')
+        r = ArrayCompactAlignment()
+        r.read_filepath(data_source_path('small.fasta'), 'FASTA')
+        self.assertSameCompact(c, r)
+
+    def testMergeAndMask(self):
+        a1, c, n = self._read_pair('merger1.fasta')
+        a2, c2, n2 = self._read_pair('merger2.fasta')
+        c.merge_in(c2)
+        n.merge_in(n2)
+        self.assertSameCompact(c, n)
+        c.mask_gapy_sites(3)
+        n.mask_gapy_sites(3)
+        self.assertSameCompact(c, n)
+        sub = n.sub_alignment(list(n.keys())[:2])
+        self.assertTrue(isinstance(sub, ArrayCompactAlignment))
+        self.assertEqual(sub.get_num_taxa(), 2)
+
+    def testMergeMany(self):
+        a1, c, n = self._read_pair('merger1.fasta')
+        a2, c2, n2 = self._read_pair('merger2.fasta')
+        a3 = Alignment()
+        for k in list(a2.keys())[:2]:
+            a3[k] = a2[k]
+        a3['extra'] = ('-A' * len(a2[k]))[:len(a2[k])]
+        c3 = CompactAlignment()
+        c3.update_from_alignment(a3)
+        n3 = ArrayCompactAlignment()
+        n3.update_from_alignment(a3)
+        c.merge_in_many([c2, c3])
+        n.merge_in_many([n2, n3])
+        self.assertSameCompact(c, n)
+
+    def testMaskUnalignedSites(self):
+        a = Alignment()
+        a['1'] = 'Aa-CG-t'
+        a['2'] = 'A-cCGT-'
+        a['3'] = '-A-CG-T'
+        c = CompactAlignment()
+        c.update_from_alignment(a)
+        n = ArrayCompactAlignment()
+        n.update_from_alignment(a)
+        c.mask_unaligned_sites()
+        n.mask_unaligned_sites()
+        self.assertSameCompact(c, n)
+        self.assertEqual(n.as_string_sequence('2'), 'ACGT')
+
+    def testColumnMaps(self):
+        me_ins = numpy.array([True, False, True, False, True])
+        she_ins = numpy.array([False, True, True, False])
+        memap, shemap = transitivity_column_maps(me_ins, she_ins)
+        self.assertEqual(memap.tolist(), [0, 1, 2, 5, 6])
+        self.assertEqual(shemap.tolist(), [1, 3, 4, 5])
+        self.assertTrue(transitivity_column_maps(me_ins, she_ins[1:]) is None)
+
 class SeqDatasetTest(unittest.TestCase):
 
     #def testTaxonRelabeling(self):
@@ -8,7 +8,7 @@ import os
 from pasta.test import get_testing_configuration, data_source_path, TestLevel, is_test_enabled
 
 from pasta import get_logger
-from pasta.alignment import Alignment
+from pasta.alignment import Alignment, CompactAlignment
 from pasta.scheduler import jobq, start_worker
 from pasta.filemgr import TempFS
 
@@ -64,6 +64,11 @@ your installation is not configured to run this tool.
                     tmp_dir_par=self.ts.top_level_temp,
                     delete_temps=True)
 
+        if isinstance(a, CompactAlignment):
+            t = Alignment()
+            a.update_dict_from(t)
+            a = t
+
         reference_fn = data_source_path('merger_result.fasta')
         reference_aln = Alignment()
         reference_aln.read_filepath(reference_fn, 'FASTA')
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+from pasta.scheduler import DispatchableJob, worker, set_executor, get_executor
+from pasta.scheduler import LoggingQueue, MakespanTracker, CpuSlots
+from threading import Thread
+from pasta import get_logger
+
+_LOG = get_logger(__name__)
+
+class DirectExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='schedulertest')
+        self.old_executor = get_executor()
+        set_executor('direct')
+        self.w = worker(0)
+    def tearDown(self):
+        set_executor(self.old_executor)
+        shutil.rmtree(self.dir)
+
+    def testBadExecutor(self):
+        self.assertRaises(ValueError, set_executor, 'bogus')
+
+    def testRun(self):
+        self.assertTrue(self.w.p is None)
+        out = os.path.join(self.dir, 'out.txt')
+        job = DispatchableJob([sys.executable, '-c', 'import os; print(os.getcwd())'],
+                              result_processor=lambda : open(out).read().strip(),
+                              cwd=self.dir,
+                              stdout=out)
+        plj = self.w._run_directly(job.start())
+        self.assertEqual(plj.return_code, 0)
+        self.assertTrue(plj.error is None)
+        self.assertEqual(os.path.realpath(job.result_processor()), os.path.realpath(self.dir))
+
+    def testFailure(self):
+        job = DispatchableJob([sys.executable, '-c', 'import sys; sys.stderr.write("boom"); sys.exit(3)'],
+                              result_processor=None,
+                              cwd=self.dir)
+        plj = self.w._run_directly(job.start())
+        self.assertEqual(plj.return_code, 3)
+        self.assertTrue('boom' in plj.error)
+
+class _CostedJob(object):
+    def __init__(self, name, estimated_cost=0, parents=()):
+        self.context_str = name
+        self.estimated_cost = estimated_cost
+        self.parent_tickable_job = list(parents)
+
+class _Parent(object):
+    def __init__(self, remaining):
+        self.remaining = remaining
+    def remaining_critical_path(self):
+        return self.remaining
+
+class CriticalPathQueueTest(unittest.TestCase):
+    def testOrder(self):
+        q = LoggingQueue()
+        jobs = [_CostedJob('a'),
+                _CostedJob('b', 5),
+                _CostedJob('c', 1, [_Parent(10), _Parent(2)]),
+                _CostedJob('d'),
+                _CostedJob('e', 5)]
+        for j in jobs:
+            q.put(j)
+        self.assertEqual(jobs[2].critical_path, 11)
+        order = [q.get().context_str for j in jobs]
+        self.assertEqual(order, ['c', 'b', 'e', 'a', 'd'])
+        self.assertTrue(q.empty())
+
+    def testMakespans(self):
+        t = MakespanTracker()
+        self.assertTrue(t.makespans(2) is None)
+        t.record(_CostedJob('a', 2), 0.0, 2.0)
+        t.record(_CostedJob('b', 2), 0.0, 2.0)
+        t.record(_CostedJob('c', 4), 2.0, 6.0)
+        projected, actual = t.makespans(2)
+        self.assertAlmostEqual(actual, 6.0)
+        self.assertAlmostEqual(projected, 4.0)
+        t.reset()
+        self.assertTrue(t.makespans(2) is None)
+
+class CpuSlotsTest(unittest.TestCase):
+    def testPacking(self):
+        slots = CpuSlots(4)
+        self.assertEqual(slots.acquire(3), 3)
+        self.assertEqual(slots.acquire(10), 1)
+        got = []
+        t = Thread(target=lambda : got.append(slots.acquire(2)))
+        t.start()
+        t.join(0.2)
+        self.assertEqual(got, [])
+        # free slots are not handed out past a job waiting for its own
+        self.assertEqual(slots.acquire_free(4), 0)
+        slots.release(3)
+        t.join(5)
+        self.assertEqual(got, [2])
+        self.assertEqual(slots.acquire_free(4), 1)
+        self.assertEqual(slots.in_use, 4)
+
+    def testSetThreads(self):
+        job = DispatchableJob(['mafft', '--thread', '1', 'in.fasta'],
+                              result_processor=None,
+                              num_threads=1,
+                              thread_option='--thread')
+        self.assertFalse('num_threads' in job._kwargs)
+        job.set_threads(6)
+        self.assertEqual(job.start()[0], ['mafft', '--thread', '6', 'in.fasta'])
+        self.assertEqual(job.num_threads, 6)
+
+if __name__ == "__main__":
+    unittest.main()
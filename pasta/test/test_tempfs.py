@@ -1,7 +1,9 @@
 #! /usr/bin/env python
 import unittest
 import os
-from pasta.filemgr import TempFS
+import shutil
+import tempfile
+from pasta.filemgr import TempFS, ResultCache
 from pasta import get_logger
 
 _LOG = get_logger(__name__)
@@ -117,6 +119,40 @@ class TempFSTest(unittest.TestCase):
         self.assertRaises(OSError, self.ts.create_temp_subdir, prefix='bogus', parent=d)
 
 
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='resultcache')
+        self.cache = ResultCache(os.path.join(self.dir, 'cache'), max_mb=1)
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, content):
+        fn = os.path.join(self.dir, name)
+        f = open(fn, 'w')
+        f.write(content)
+        f.close()
+        return fn
+
+    def testKey(self):
+        a = self._write('a', '>x\nACGT\n')
+        b = self._write('b', '>x\nACGA\n')
+        self.assertEqual(self.cache.key(['mafft', '--quiet'], [a]), self.cache.key(['mafft', '--quiet'], [a]))
+        self.assertNotEqual(self.cache.key(['mafft', '--quiet'], [a]), self.cache.key(['mafft', '--quiet'], [b]))
+        self.assertNotEqual(self.cache.key(['mafft', '--quiet'], [a]), self.cache.key(['mafft'], [a]))
+
+    def testFetchAndEvict(self):
+        dest = os.path.join(self.dir, 'dest')
+        self.assertFalse(self.cache.fetch('ab01', dest))
+        self.cache.put('ab01', self._write('small', 'ACGT'))
+        self.assertTrue(self.cache.fetch('ab01', dest))
+        self.assertEqual(open(dest).read(), 'ACGT')
+        big = self._write('big', 'A' * (700 * 1024))
+        self.cache.put('cd02', big)
+        os.utime(self.cache._entry_path('cd02'), (1, 1))
+        self.cache.put('ef03', big)
+        self.assertFalse(self.cache.fetch('cd02', dest))
+        self.assertTrue(self.cache.fetch('ef03', dest))
+        self.assertTrue(self.cache.fetch('ab01', dest))
 
 if __name__ == "__main__":
     unittest.main()
@@ -33,7 +33,7 @@ from pasta.filemgr import open_with_intermediates
 from pasta.scheduler import jobq, start_worker, DispatchableJob, FakeJob,\
     TickingDispatchableJob
 
-from .alignment import Alignment, MultiLocusDataset
+from .alignment import Alignment, MultiLocusDataset, AlignmentView, new_compact_alignment
 import copy
 
 _LOG = get_logger(__name__)
@@ -64,11 +64,22 @@ def read_internal_alignment(fn,
                             file_format='FASTA',
                             datatype=None,
                             dirs_to_delete=(),
-                            temp_fs=None):
-    alignment = Alignment()
+                            temp_fs=None,
+                            compact=False,
+                            result_cache=None,
+                            cache_key=None):
+    """Reads the alignment produced by a tool. If `compact` is True, the
+    alignment is read straight into a CompactAlignment. If a `result_cache`
+    and `cache_key` are given, the file is also stored in the cache."""
+    if compact:
+        alignment = new_compact_alignment()
+    else:
+        alignment = Alignment()
     alignment.datatype = datatype
     alignment.read_filepath(fn, file_format=file_format)
     if len(alignment) >= 1:
+        if result_cache is not None and cache_key is not None:
+            result_cache.put(cache_key, fn)
         if dirs_to_delete:
             assert(temp_fs)
             for d in dirs_to_delete:
@@ -181,6 +192,7 @@ class ExternalTool (object):
             raise ValueError(msg)
 
         self.delete_temps = kwargs.get('delete_temps', True)
+        self.result_cache = kwargs.get('result_cache')
 
     @staticmethod
     def exists(self):
@@ -191,6 +203,41 @@ class ExternalTool (object):
         scratch_dir = self.temp_fs.create_temp_subdir(parent=tmp_dir_par, prefix=pref)
         return scratch_dir
 
+    def _result_cache_key(self, invoc, scratch_dir, datatype, extra_inputs=(), thread_option=None):
+        """Returns the result cache key of the invocation `invoc` (with the
+        scratch directory and thread count factored out and the input files
+        it names hashed), or None if no result cache is in use."""
+        if self.result_cache is None:
+            return None
+        parts = [self.name, datatype]
+        try:
+            st = os.stat(self.exe)
+            parts.extend([st.st_size, int(st.st_mtime)])
+        except OSError:
+            pass
+        inputs = list(extra_inputs)
+        for i, arg in enumerate(invoc):
+            if arg == self.exe:
+                continue
+            if thread_option is not None and i > 0 and invoc[i - 1] == thread_option:
+                continue
+            parts.append(arg.replace(scratch_dir, '<scratch>'))
+            if os.path.isfile(arg):
+                inputs.append(arg)
+        return self.result_cache.key(parts, inputs)
+
+    def _cached_result_job(self, cache_key, result_fn, datatype, dirs_to_delete, job_id):
+        """Returns a FakeJob holding the cached alignment for `cache_key`, or
+        None if it is not in the result cache."""
+        if cache_key is None or not self.result_cache.fetch(cache_key, result_fn):
+            return None
+        alignment = read_internal_alignment(result_fn,
+                                            datatype=datatype,
+                                            dirs_to_delete=dirs_to_delete,
+                                            temp_fs=self.temp_fs,
+                                            compact=True)
+        return FakeJob(alignment, context_str=job_id)
+
     def run(self, *args, **kwargs):
         start_worker(1)
         job = self.create_job(*args, **kwargs)
@@ -272,26 +319,38 @@ class Aligner(ExternalTool):
         raise NotImplementedError('Abstract Aligner class cannot spawn jobs.')
 
     def _finish_standard_job(self, alignedfn, datatype, invoc, scratch_dir, 
-                             job_id, delete_temps, stdout=None):
+                             job_id, delete_temps, stdout=None,
+                             num_threads=1, thread_option=None):
         dirs_to_delete = []
         if delete_temps:
             dirs_to_delete = [scratch_dir]
+        cache_key = self._result_cache_key(invoc, scratch_dir, datatype, thread_option=thread_option)
+        job = self._cached_result_job(cache_key, alignedfn, datatype, dirs_to_delete, job_id)
+        if job is not None:
+            return job
         # create a results processor to read the alignment file
         rpc = lambda : read_internal_alignment(alignedfn,
                                                datatype=datatype,
                                                dirs_to_delete=dirs_to_delete,
-                                               temp_fs=self.temp_fs)
+                                               temp_fs=self.temp_fs,
+                                               compact=True,
+                                               result_cache=self.result_cache,
+                                               cache_key=cache_key)
         if stdout:
             job = TickingDispatchableJob(invoc,
                                   result_processor=rpc,
                                   cwd=scratch_dir,
                                   stdout=stdout,
-                                  context_str=job_id)
+                                  context_str=job_id,
+                                  num_threads=num_threads,
+                                  thread_option=thread_option)
         else:
             job = TickingDispatchableJob(invoc,
                                   result_processor=rpc,
                                   cwd=scratch_dir,
-                                  context_str=job_id)
+                                  context_str=job_id,
+                                  num_threads=num_threads,
+                                  thread_option=thread_option)
         
         return job
 
@@ -346,7 +405,9 @@ class MafftAligner(Aligner):
                 scratch_dir=scratch_dir,
                 job_id=job_id,
                 delete_temps=kwargs.get('delete_temps', self.delete_temps),
-                stdout=alignedfn)
+                stdout=alignedfn,
+                num_threads=kwargs.get('num_cpus', 1),
+                thread_option='--thread')
 
 class GinsiAligner(Aligner):
     section_name = 'ginsi aligner'
@@ -388,7 +449,9 @@ class GinsiAligner(Aligner):
                 scratch_dir=scratch_dir,
                 job_id=job_id,
                 delete_temps=kwargs.get('delete_temps', self.delete_temps),
-                stdout=alignedfn)
+                stdout=alignedfn,
+                num_threads=kwargs.get('num_cpus', 1),
+                thread_option='--thread')
 
 class HomologsAligner(Aligner):
     section_name = 'homologs aligner'
@@ -421,7 +484,9 @@ class HomologsAligner(Aligner):
                 scratch_dir=scratch_dir,
                 job_id=job_id,
                 delete_temps=kwargs.get('delete_temps', self.delete_temps),
-                stdout=alignedfn)
+                stdout=alignedfn,
+                num_threads=kwargs.get('num_cpus', 1),
+                thread_option='--thread')
 
 
 class OpalAligner(Aligner):
@@ -642,6 +707,8 @@ class FakeAligner(Aligner):
 
     def create_job(self, alignment, guide_tree=None, **kwargs):
         job_id = kwargs.get('context_str', '') + '_fakealigner'
+        if isinstance(alignment, AlignmentView):
+            alignment = alignment.materialize()
         return FakeJob(alignment, context_str=job_id)
 
 class PadAligner(Aligner):
@@ -686,15 +753,29 @@ class Merger(ExternalTool):
         outfn = os.path.join(scratch_dir, 'out.fasta')
         return scratch_dir, seqfn1, seqfn2, outfn
 
+    def _merge_with_empty(self, alignment1, alignment2):
+        """Result of merging two alignments when at least one of them has no
+        taxa; works for both Alignment and CompactAlignment objects."""
+        if alignment1.get_num_taxa() < 1:
+            return alignment2
+        return alignment1
+
     def _finish_standard_job(self, alignedfn, datatype, invoc, scratch_dir, job_id, delete_temps):
         dirs_to_delete = []
         if delete_temps:
             dirs_to_delete = [scratch_dir]
+        cache_key = self._result_cache_key(invoc, scratch_dir, datatype)
+        job = self._cached_result_job(cache_key, alignedfn, datatype, dirs_to_delete, job_id)
+        if job is not None:
+            return job
         # create a results processor to read the alignment file
         rpc = lambda : read_internal_alignment(alignedfn,
                                                datatype=datatype,
                                                dirs_to_delete=dirs_to_delete,
-                                               temp_fs=self.temp_fs)
+                                               temp_fs=self.temp_fs,
+                                               compact=True,
+                                               result_cache=self.result_cache,
+                                               cache_key=cache_key)
         job = TickingDispatchableJob(invoc, result_processor=rpc,  cwd=scratch_dir, context_str=job_id)
         return job
 
@@ -734,8 +815,7 @@ class PadMerger(Merger):
     def create_job(self, alignment1, alignment2, **kwargs):
         job_id = kwargs.get('context_str', '') + '_padmerger'
         if (alignment1.get_num_taxa() < 1) or (alignment2.get_num_taxa() < 1):
-            alignment1.update(alignment2)
-            return FakeJob(alignment1, context_str=job_id)
+            return FakeJob(self._merge_with_empty(alignment1, alignment2), context_str=job_id)
         scratch_dir, seqfn1, seqfn2, outfn = self._prepare_input(alignment1, alignment2, **kwargs)
 
         invoc = [sys.executable, self.exe, alignment1.datatype, seqfn1, seqfn2, outfn]
@@ -758,8 +838,7 @@ class MuscleMerger (Merger):
     def create_job(self, alignment1, alignment2, **kwargs):
         job_id = kwargs.get('context_str', '') + '_muscle'
         if (alignment1.get_num_taxa() < 1) or (alignment2.get_num_taxa() < 1):
-            alignment1.update(alignment2)
-            return FakeJob(alignment1, context_str=job_id)
+            return FakeJob(self._merge_with_empty(alignment1, alignment2), context_str=job_id)
         scratch_dir, seqfn1, seqfn2, outfn = self._prepare_input(alignment1, alignment2, **kwargs)
 
         invoc = [self.exe, '-in1', seqfn1, '-in2', seqfn2, '-out', outfn, '-quiet', '-profile']
@@ -824,27 +903,34 @@ class OpalMerger (Merger):
             dirs_to_delete = [scratch_dir]
         fn = os.path.join(scratch_dir, 'out_rep.fasta') if datatype.lower() == 'protein' else None
         rep_fn = os.path.join(scratch_dir, 'out.fasta')
+        # the U->X replacement files are named in invoc; key on the originals too
+        cache_key = self._result_cache_key(invoc, scratch_dir, datatype,
+                extra_inputs=[os.path.join(scratch_dir, "1.fasta"), os.path.join(scratch_dir, "2.fasta")])
+        job = self._cached_result_job(cache_key, rep_fn, datatype, dirs_to_delete, job_id)
+        if job is not None:
+            return job
         # create a results processor to read the alignment file
         rpc = lambda : self.__read_opal_alignment__(fn, rep_fn, rep_locations,
                                                datatype,
                                                dirs_to_delete,
-                                               self.temp_fs)
+                                               self.temp_fs,
+                                               cache_key)
         job = TickingDispatchableJob(invoc, result_processor=rpc,  cwd=scratch_dir, context_str=job_id)
         return job
     
-    def __read_opal_alignment__(self,fn,rep_fn,rep_locations,datatype,dirs_to_delete,temp_fs):
+    def __read_opal_alignment__(self,fn,rep_fn,rep_locations,datatype,dirs_to_delete,temp_fs,cache_key=None):
         if datatype.lower() == 'protein':
             seqNames,aln = read_fasta(fn)
             replace_back('U',aln,rep_locations)
             write_fasta(rep_fn,seqNames,aln)
-        return read_internal_alignment(rep_fn,datatype=datatype,dirs_to_delete=dirs_to_delete,temp_fs=temp_fs)
+        return read_internal_alignment(rep_fn,datatype=datatype,dirs_to_delete=dirs_to_delete,temp_fs=temp_fs,compact=True,
+                                       result_cache=self.result_cache,cache_key=cache_key)
 
 
     def create_job(self, alignment1, alignment2, **kwargs):
         job_id = kwargs.get('context_str', '') + '_opal'
         if (alignment1.get_num_taxa() < 1) or (alignment2.get_num_taxa() < 1):
-            alignment1.update(alignment2)
-            return FakeJob(alignment1, context_str=job_id)
+            return FakeJob(self._merge_with_empty(alignment1, alignment2), context_str=job_id)
         scratch_dir, seqfn1, seqfn2, outfn, rep_locations = self._prepare_input(alignment1, alignment2, **kwargs)
         assert(alignment1.datatype == alignment2.datatype)
 
@@ -1066,13 +1152,15 @@ class FastTree(TreeEstimator):
 
         invoc.extend(['-log', log_file,    seqfn ])
 
+        num_threads = 1
         if num_cpus > 1:
             if platform.system() == 'Windows':
                 mp_path = self.exe.replace('.', 'MP.')
             else:
                 mp_path = self.exe + 'MP'
             if os.path.exists(mp_path):
-                os.environ["OMP_NUM_THREADS"] = str(num_cpus if num_cpus < 5 else 4)
+                num_threads = num_cpus if num_cpus < 5 else 4
+                os.environ["OMP_NUM_THREADS"] = str(num_threads)
                 invoc[0] = mp_path
 
         dirs_to_delete = []
@@ -1088,7 +1176,8 @@ class FastTree(TreeEstimator):
                                              pasta_products=pasta_products,
                                              step_num=step_num)
         job_id = kwargs.get('context_str', '') + '_fasttree'
-        job = DispatchableJob(invoc, result_processor=rpc, cwd=scratch_dir, stdout=fasttree_result, context_str=job_id)
+        job = DispatchableJob(invoc, result_processor=rpc, cwd=scratch_dir, stdout=fasttree_result, context_str=job_id,
+                              num_threads=num_threads)
         return job
 
 class Raxml(TreeEstimator):
@@ -1191,7 +1280,8 @@ class Raxml(TreeEstimator):
                                           pasta_products=pasta_products,
                                           step_num=step_num)
         job_id = kwargs.get('context_str', '') + '_raxml'
-        job = DispatchableJob(invoc, result_processor=rpc, cwd=scratch_dir, context_str=job_id)
+        job = DispatchableJob(invoc, result_processor=rpc, cwd=scratch_dir, context_str=job_id,
+                              num_threads=num_cpus if num_cpus > 1 else 1)
         return job
 
 class HMMERAlignAligner(Aligner):
@@ -38,6 +38,7 @@ param = {
     'test_suite': "pasta.test",
     'include_package_data': True,
     'install_requires': ['dendropy>=4.00'],
+    'extras_require': {'numpy': ['numpy']},
     'scripts' : [script_name,gui_script_name,'run_seqtools.py'],
     'zip_safe': True,
     'keywords': 'Phylogenetics Evolution Biology',